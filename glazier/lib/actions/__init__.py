@@ -63,6 +63,7 @@ RegDel = registry.RegDel
 RmDir = file_system.RmDir
 MultiRegDel = registry.MultiRegDel
 SetTimer = timers.SetTimer
+SetTimers = timers.SetTimers
 SetUnattendTimeZone = sysprep.SetUnattendTimeZone
 SetupCache = file_system.SetupCache
 SpliceDomainJoin = splice.SpliceDomainJoin
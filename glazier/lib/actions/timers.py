@@ -21,23 +21,49 @@ from glazier.lib import constants
 from glazier.lib import registry
 from glazier.lib.actions.base import ActionError
 from glazier.lib.actions.base import BaseAction
+from glazier.lib.actions.base import ValidationError
+
+_TIMERS_KEY = f'{constants.REG_ROOT}\\Timers'
 
 
 class SetTimer(BaseAction):
   """Create an imaging timer."""
 
   def Run(self):
-    timer = str(self._args[0])
-    key_path = r'{0}\{1}'.format(constants.REG_ROOT, 'Timers')
-
+    timer = self._args[0]
     self._build_info.TimerSet(timer)
-    value_name = 'TIMER_' + timer
     value_data = str(self._build_info.TimerGet(timer))
     try:
-      registry.set_value(value_name, value_data, 'HKLM', key_path, log=False)
+      registry.set_value(f'TIMER_{timer}', value_data, 'HKLM', _TIMERS_KEY,
+                         log=False)
       logging.info('Set image timer: %s (%s)', timer, value_data)
     except registry.Error as e:
       raise ActionError(e)
 
   def Validate(self):
     self._ListOfStringsValidator(self._args)
+
+
+class SetTimers(BaseAction):
+  """Create multiple imaging timers in one action."""
+
+  def Run(self):
+    values = {}
+    for timer in self._args:
+      self._build_info.TimerSet(timer)
+      values[f'TIMER_{timer}'] = str(self._build_info.TimerGet(timer))
+    try:
+      registry.set_values(values, 'HKLM', _TIMERS_KEY, log=False)
+    except registry.Error as e:
+      raise ActionError(e)
+    for timer in self._args:
+      logging.info('Set image timer: %s (%s)', timer, values[f'TIMER_{timer}'])
+
+  def Validate(self):
+    self._TypeValidator(self._args, list)
+    if not self._args:
+      raise ValidationError('Invalid args length: %s' % self._args)
+    for arg in self._args:
+      self._TypeValidator(arg, str)
+    if len(set(self._args)) != len(self._args):
+      raise ValidationError('Duplicate timer names: %s' % self._args)
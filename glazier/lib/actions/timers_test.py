@@ -57,6 +57,42 @@ class TimersTest(absltest.TestCase):
     st = timers.SetTimer([VALUE_NAME], None)
     st.Validate()
 
+  @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
+  @mock.patch.object(timers.registry, 'set_values', autospec=True)
+  @mock.patch.object(timers.logging, 'info', autospec=True)
+  def testSetTimers(self, i, sv, build_info):
+    build_info.TimerGet.return_value = VALUE_DATA
+    st = timers.SetTimers([VALUE_NAME, 'other'], build_info)
+    st.Run()
+    build_info.TimerSet.assert_has_calls(
+        [mock.call(VALUE_NAME), mock.call('other')])
+    sv.assert_called_once_with(
+        {'TIMER_' + VALUE_NAME: VALUE_DATA, 'TIMER_other': VALUE_DATA},
+        'HKLM', KEY_PATH, log=False)
+    i.assert_called_with('Set image timer: %s (%s)', 'other', VALUE_DATA)
+
+  @mock.patch('glazier.lib.buildinfo.BuildInfo', autospec=True)
+  @mock.patch.object(timers.registry, 'set_values', autospec=True)
+  def testSetTimersError(self, sv, build_info):
+    build_info.TimerGet.return_value = VALUE_DATA
+    sv.side_effect = timers.registry.Error
+    st = timers.SetTimers([VALUE_NAME], build_info)
+    self.assertRaises(timers.ActionError, st.Run)
+
+  def testSetTimersValidate(self):
+    st = timers.SetTimers(VALUE_NAME, None)
+    self.assertRaises(ValidationError, st.Validate)
+    st = timers.SetTimers([], None)
+    self.assertRaises(ValidationError, st.Validate)
+    st = timers.SetTimers([VALUE_NAME, 1], None)
+    self.assertRaises(ValidationError, st.Validate)
+    st = timers.SetTimers([VALUE_NAME, VALUE_NAME], None)
+    self.assertRaises(ValidationError, st.Validate)
+    st = timers.SetTimers([VALUE_NAME, 'other'], None)
+    st.Validate()
+    st = timers.SetTimers(['timer_%d' % i for i in range(150)], None)
+    st.Validate()
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -24,10 +24,15 @@ from __future__ import division
 from __future__ import print_function
 
 import base64
-import functools
+import codecs
 import hashlib
+import io
 import json
 import logging
+import mmap
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 from absl import flags
 from glazier.lib import constants
@@ -35,6 +40,12 @@ from glazier.lib import registry
 from gwinpy.wmi import hw_info
 from gwinpy.wmi import wmi_query
 import requests
+from requests import adapters
+
+try:
+  import orjson  # pylint: disable=g-import-not-at-top
+except ImportError:
+  orjson = None
 
 FLAGS = flags.FLAGS
 
@@ -42,39 +53,109 @@ flags.DEFINE_boolean('use_signed_url', False,
                      'Select whether or not to use signed urls')
 flags.DEFINE_string('sign_endpoint', None, 'The signing URL endpoint to use')
 flags.DEFINE_string('seed_path', None, 'Path to the seed file on disk')
+flags.DEFINE_integer(
+    'signed_url_ttl', 600,
+    'Seconds a signed URL is reused before requesting a new one. Must be '
+    'shorter than the lifetime of URLs issued by sign_endpoint. 0 disables '
+    'reuse.')
+
+# Seconds to wait on the sign endpoint before giving up.
+SIGN_TIMEOUT = 10
 
 
 class BCError(Exception):
   pass
 
 
+# Shared by all BeyondCorp instances so keep-alive connections to the sign
+# endpoint carry over between downloaders. Built on first use.
+_session = None
+
+
+def _GetSession() -> requests.Session:
+  """Returns the session used to reach the sign endpoint."""
+  global _session
+  if _session is None:
+    _session = requests.Session()
+    _session.mount(
+        'https://',
+        adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=4,
+            max_retries=adapters.Retry(total=2, backoff_factor=0.2)))
+  return _session
+
+
+# Each downloader builds its own BeyondCorp, so values that should outlive a
+# single download are cached at module scope.
+# (path, wim hash, mac addresses) -> (signed url, expiration)
+_signed_urls: Dict[Tuple[str, str, Tuple[str, ...]], Tuple[str, float]] = {}
+# (path, mtime, size) -> base64 encoded hash
+_wim_hashes: Dict[Tuple[str, int, int], bytes] = {}
+# (path, mtime) -> parsed seed file
+_seeds: Dict[Tuple[str, int], Dict[str, Any]] = {}
+# Neither changes during an imaging session, so WMI is queried only once.
+_drive_letter: Optional[str] = None
+_macs: Optional[List[str]] = None
+
+
+def _JsonLoads(data: bytes) -> Any:
+  """Decodes JSON, using orjson when it is installed."""
+  if orjson:
+    # json.loads accepts a UTF-8 byte order mark but orjson rejects it.
+    if data.startswith(codecs.BOM_UTF8):
+      data = data[len(codecs.BOM_UTF8):]
+    return orjson.loads(data)
+  return json.loads(data)
+
+
+def _JsonDumps(obj: Any) -> bytes:
+  """Encodes obj as compact UTF-8 JSON with sorted keys."""
+  if orjson:
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+  return json.dumps(
+      obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
 class BeyondCorp(object):
   """Defines funtions needed to retrieve a signed URL."""
 
+  def __init__(self):
+    self._bc_state: Optional[bool] = None
+
   def _ReadFile(self):
     """Reads the seed file and returns a json blob.
 
+    The parsed seed is reused until the file's modification time changes.
+
     Returns:
       contents of the file.
     """
     try:
-      with open(FLAGS.seed_path) as p:
-        return json.load(p)
+      key = (FLAGS.seed_path, os.stat(FLAGS.seed_path).st_mtime_ns)
+      if key not in _seeds:
+        with open(FLAGS.seed_path, 'rb') as p:
+          _seeds[key] = _JsonLoads(p.read())
+      return _seeds[key]
     except (FileNotFoundError, json.decoder.JSONDecodeError) as e:
       raise BCError(e)
 
-  @functools.lru_cache()
   def CheckBeyondCorp(self) -> bool:
     """Verify whether the image is running Beyond Corp.
 
+    The result is determined once per instance and reused afterwards.
+
     Returns:
       True if running beyond_corp.
       False if not running beyond_corp.
     """
+    if self._bc_state is not None:
+      return self._bc_state
 
     if FLAGS.use_signed_url:
       try:
         registry.set_value('beyond_corp', 'True', path=constants.REG_ROOT)
+        self._bc_state = True
         return True
       except registry.Error as e:
         raise BCError(e)
@@ -83,8 +164,10 @@ class BeyondCorp(object):
         bc = registry.get_value('beyond_corp', path=constants.REG_ROOT)
         if bc:
           if bc.lower() == 'true':
+            self._bc_state = True
             return True
           elif bc.lower() == 'false':
+            self._bc_state = False
             return False
       except registry.Error as e:
         logging.warning(str(e))
@@ -93,27 +176,49 @@ class BeyondCorp(object):
       registry.set_value('beyond_corp', 'False', path=constants.REG_ROOT)
     except registry.Error as e:
       raise BCError(e)
+    self._bc_state = False
     return False
 
-  @functools.lru_cache()
   def _GetHash(self, file_path: str) -> bytes:
     """Calculates the hash of the boot wim.
 
+    The result is reused until the file's modification time or size changes.
+
     Args:
       file_path: path to the file to be hashed
 
     Returns:
       hash of boot wim in hex
     """
-    block_size = 33554432  # define bytes to read at a time when hashing (32mb)
-    hasher = hashlib.sha256()
-
-    with open(file_path, 'rb') as f:
-      fb = f.read(block_size)
-      while fb:
-        hasher.update(fb)
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    if key in _wim_hashes:
+      return _wim_hashes[key]
+
+    block_size = 33554432  # bytes to hash at a time (32mb)
+    # Unbuffered, since reads below are already in large blocks.
+    with open(file_path, 'rb', buffering=0) as f:
+      hasher = None
+      if isinstance(f, io.FileIO) and stat.st_size:
+        # Hash straight from the page cache without copying into a buffer.
+        try:
+          with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+              mapped = hashlib.sha256()
+              for offset in range(0, len(view), block_size):
+                mapped.update(view[offset:offset + block_size])
+          hasher = mapped
+        except (OSError, ValueError) as e:
+          logging.warning('Unable to map %s, reading it instead: %s',
+                          file_path, e)
+      if hasher is None:
+        hasher = hashlib.sha256()
         fb = f.read(block_size)
-    return base64.b64encode(hasher.digest())
+        while fb:
+          hasher.update(fb)
+          fb = f.read(block_size)
+    _wim_hashes[key] = base64.b64encode(hasher.digest())
+    return _wim_hashes[key]
 
   def _GetDisk(self, label: str) -> str:
     """Leverages the drive label to define the drive letter.
@@ -162,36 +267,41 @@ class BeyondCorp(object):
       raise BCError('sign_endpoint and seed_path cannot be None when using'
                     'Signed URL.')
 
-    hwinfo = hw_info.HWInfo()
-    drive_letter = self._GetDisk(constants.USB_VOLUME_LABEL).strip(':')
-
-    data = self._ReadFile()
-    data = {
-        'Path':
-            relative_path,
-        'Mac':
-            hwinfo.MacAddresses(),
-        'Seed':
-            data['Seed'],
-        'Signature':
-            data['Signature'],
-        'Hash':
-            self._GetHash(fr'{drive_letter}:\sources\boot.wim').decode('utf-8')
-    }
-
-    req = json.dumps(
-        data,
-        ensure_ascii=True,
-        sort_keys=True,
-        indent=None,
-        separators=(',', ': '))
+    global _drive_letter, _macs
+    if _drive_letter is None:
+      _drive_letter = self._GetDisk(constants.USB_VOLUME_LABEL).strip(':')
+    if _macs is None:
+      _macs = hw_info.HWInfo().MacAddresses()
+    wim_hash = self._GetHash(
+        fr'{_drive_letter}:\sources\boot.wim').decode('utf-8')
+
+    key = (relative_path, wim_hash, tuple(_macs))
+    cached = _signed_urls.get(key)
+    if cached and cached[1] > time.monotonic():
+      logging.debug('Reusing signed URL for %s', relative_path)
+      return cached[0]
+
+    seed = self._ReadFile()
+    req = _JsonDumps({
+        'Hash': wim_hash,
+        'Mac': _macs,
+        'Path': relative_path,
+        'Seed': seed['Seed'],
+        'Signature': seed['Signature']
+    })
     try:
-      res = requests.post(FLAGS.sign_endpoint, data=req)
-    except requests.exceptions.ConnectionError as e:
+      res = _GetSession().post(
+          FLAGS.sign_endpoint, data=req, timeout=SIGN_TIMEOUT)
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout) as e:
       raise BCError(e)
 
-    if res.status_code != 200 or res.json(
-    )['Status'] != 'Success' or not res.json()['SignedURL']:
+    resp = _JsonLoads(res.content)
+    if (res.status_code != 200 or resp['Status'] != 'Success' or
+        not resp['SignedURL']):
       raise BCError('Invalid response from signed url. Code: %s, Status: %s' %
-                    (res.status_code, res.json()['Status']))
-    return res.json()['SignedURL']
+                    (res.status_code, resp['Status']))
+    signed_url = resp['SignedURL']
+    if FLAGS.signed_url_ttl > 0:
+      _signed_urls[key] = (signed_url, time.monotonic() + FLAGS.signed_url_ttl)
+    return signed_url
@@ -18,7 +18,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import codecs
+import hashlib
 import json
+import unittest
 
 from absl.testing import absltest
 from absl.testing import flagsaver
@@ -33,6 +36,7 @@ _TEST_WIM = 'test_wim'
 _TEST_WIM_PATH = r'D:\sources\boot.wim'
 _TEST_WIM_HASH = b'xxaroj1bgT5sObhJ0HwOtqpn+Nx0gO/Wz5wATtYK7Tk='
 DECODED_HASH = _TEST_WIM_HASH.decode('utf-8')
+_NON_ASCII_PATH = 'unstable/caf\u00e9/\u65e5.yaml'
 
 
 def _CreateSignResponse(code, status, wim_hash):
@@ -46,28 +50,48 @@ def _CreateSignResponse(code, status, wim_hash):
 
 class BeyondcorpTest(absltest.TestCase):
 
+  @classmethod
+  def setUpClass(cls):
+    super(BeyondcorpTest, cls).setUpClass()
+    cls.filesystem = fake_filesystem.FakeFilesystem()
+    cls.filesystem.create_file(r'C:\seed.json', contents=_TEST_SEED)
+    cls.filesystem.create_file(
+        r'C:\bom_seed.json', contents=codecs.BOM_UTF8 + _TEST_SEED.encode())
+    cls.filesystem.create_file(_TEST_WIM_PATH, contents=_TEST_WIM)
+    cls._os = beyondcorp.os
+    beyondcorp.os = fake_filesystem.FakeOsModule(cls.filesystem)
+    beyondcorp.open = fake_filesystem.FakeFileOpen(cls.filesystem)
+
+  @classmethod
+  def tearDownClass(cls):
+    super(BeyondcorpTest, cls).tearDownClass()
+    beyondcorp.os = cls._os
+    del beyondcorp.open
+
   def setUp(self):
     super(BeyondcorpTest, self).setUp()
-    self.__saved_flags = flagsaver.save_flag_values()
-    mock_wmi = mock.patch.object(
-        beyondcorp.wmi_query, 'WMIQuery', autospec=True)
-    self.addCleanup(mock_wmi.stop)
-    self.mock_wmi = mock_wmi.start()
-    self.filesystem = fake_filesystem.FakeFilesystem()
-    self.filesystem.create_file(r'C:\seed.json', contents=_TEST_SEED)
-    self.filesystem.create_file(_TEST_WIM_PATH, contents=_TEST_WIM)
-    beyondcorp.os = fake_filesystem.FakeOsModule(self.filesystem)
-    beyondcorp.open = fake_filesystem.FakeFileOpen(self.filesystem)
+    # Reset the module level caches shared by BeyondCorp instances.
+    for name, value in (('_signed_urls', {}), ('_wim_hashes', {}),
+                        ('_seeds', {}), ('_drive_letter', None),
+                        ('_macs', None)):
+      patcher = mock.patch.object(beyondcorp, name, value)
+      self.addCleanup(patcher.stop)
+      patcher.start()
     self.beyondcorp = beyondcorp.BeyondCorp()
 
-  def tearDown(self):
-    super(BeyondcorpTest, self).tearDown()
-    flagsaver.restore_flag_values(self.__saved_flags)
+  @mock.patch.object(beyondcorp, '_session', None)
+  @mock.patch.object(beyondcorp.requests, 'Session', autospec=True)
+  def testGetSession(self, session):
+    beyondcorp.BeyondCorp()
+    self.assertFalse(session.called)
+    self.assertIs(beyondcorp._GetSession(), beyondcorp._GetSession())
+    session.assert_called_once_with()
 
   def testSignedUrlDisabled(self):
     with self.assertRaises(beyondcorp.BCError):
       self.beyondcorp.GetSignedUrl('unstable/test.yaml')
 
+  @flagsaver.flagsaver
   def testPathAndEndpointNone(self):
     beyondcorp.FLAGS.use_signed_url = True
     beyondcorp.FLAGS.sign_endpoint = 'https://sign-endpoint/sign'
@@ -79,9 +103,10 @@ class BeyondcorpTest(absltest.TestCase):
     with self.assertRaises(beyondcorp.BCError):
       self.beyondcorp.GetSignedUrl('unstable/test.yaml')
 
+  @flagsaver.flagsaver
   @mock.patch.object(beyondcorp.BeyondCorp, '_GetDisk', autospec=True)
   @mock.patch.object(beyondcorp.hw_info.HWInfo, 'MacAddresses', autospec=True)
-  @mock.patch.object(beyondcorp.requests, 'post', autospec=True)
+  @mock.patch.object(beyondcorp.requests.Session, 'post', autospec=True)
   def testSignedUrl(self, req, mac, drive):
     drive.return_value = 'D'
     mac.return_value = ['00:00:00:00:00:00']
@@ -92,18 +117,117 @@ class BeyondcorpTest(absltest.TestCase):
 
     sign = self.beyondcorp.GetSignedUrl('unstable/test.yaml')
     req.assert_called_once_with(
+        mock.ANY,
         'https://sign-endpoint/sign',
-        data='{"Hash": "%s",'
-        '"Mac": ["00:00:00:00:00:00"],'
-        '"Path": "unstable/test.yaml",'
-        '"Seed": {"Seed": "seed_contents"},'
-        '"Signature": "Signature"'
-        '}' % _TEST_WIM_HASH.decode('utf-8'))
+        data=b'{"Hash":"%s",'
+        b'"Mac":["00:00:00:00:00:00"],'
+        b'"Path":"unstable/test.yaml",'
+        b'"Seed":{"Seed":"seed_contents"},'
+        b'"Signature":"Signature"'
+        b'}' % _TEST_WIM_HASH,
+        timeout=beyondcorp.SIGN_TIMEOUT)
+    self.assertEqual(sign, _TEST_WIM_HASH.decode('utf-8'))
+
+    # Repeat requests for the same path are served from the cache, including
+    # from other instances.
+    sign = beyondcorp.BeyondCorp().GetSignedUrl('unstable/test.yaml')
+    self.assertEqual(req.call_count, 1)
     self.assertEqual(sign, _TEST_WIM_HASH.decode('utf-8'))
 
+  @flagsaver.flagsaver
+  @mock.patch.object(beyondcorp.BeyondCorp, '_GetDisk', autospec=True)
+  @mock.patch.object(beyondcorp.hw_info.HWInfo, 'MacAddresses', autospec=True)
+  @mock.patch.object(beyondcorp.requests.Session, 'post', autospec=True)
+  def testSignedUrlCachesWmi(self, req, mac, drive):
+    drive.return_value = 'D'
+    mac.return_value = ['00:00:00:00:00:00']
+    req.return_value = _CreateSignResponse(200, 'Success', DECODED_HASH)
+    beyondcorp.FLAGS.use_signed_url = True
+    beyondcorp.FLAGS.sign_endpoint = 'https://sign-endpoint/sign'
+    beyondcorp.FLAGS.seed_path = r'C:\seed.json'
+
+    self.beyondcorp.GetSignedUrl('unstable/test.yaml')
+    self.beyondcorp.GetSignedUrl('unstable/other.yaml')
+    self.assertEqual(req.call_count, 2)
+    self.assertEqual(mac.call_count, 1)
+    self.assertEqual(drive.call_count, 1)
+
+    # Lookups are shared with instances built by other downloaders.
+    beyondcorp.BeyondCorp().GetSignedUrl('unstable/third.yaml')
+    self.assertEqual(req.call_count, 3)
+    self.assertEqual(mac.call_count, 1)
+    self.assertEqual(drive.call_count, 1)
+
+  @flagsaver.flagsaver
+  @mock.patch.object(beyondcorp.time, 'monotonic', autospec=True)
+  @mock.patch.object(beyondcorp.BeyondCorp, '_GetDisk', autospec=True)
+  @mock.patch.object(beyondcorp.hw_info.HWInfo, 'MacAddresses', autospec=True)
+  @mock.patch.object(beyondcorp.requests.Session, 'post', autospec=True)
+  def testSignedUrlExpired(self, req, mac, drive, mono):
+    drive.return_value = 'D'
+    mac.return_value = ['00:00:00:00:00:00']
+    req.return_value = _CreateSignResponse(200, 'Success', DECODED_HASH)
+    beyondcorp.FLAGS.use_signed_url = True
+    beyondcorp.FLAGS.sign_endpoint = 'https://sign-endpoint/sign'
+    beyondcorp.FLAGS.seed_path = r'C:\seed.json'
+
+    beyondcorp.FLAGS.signed_url_ttl = 60
+
+    mono.return_value = 0
+    self.beyondcorp.GetSignedUrl('unstable/test.yaml')
+    mono.return_value = 61
+    self.beyondcorp.GetSignedUrl('unstable/test.yaml')
+    self.assertEqual(req.call_count, 2)
+
+    # A TTL of 0 disables reuse entirely.
+    beyondcorp.FLAGS.signed_url_ttl = 0
+    self.beyondcorp.GetSignedUrl('unstable/other.yaml')
+    self.beyondcorp.GetSignedUrl('unstable/other.yaml')
+    self.assertEqual(req.call_count, 4)
+
+  @flagsaver.flagsaver
+  @mock.patch.object(beyondcorp.hashlib, 'sha256', wraps=hashlib.sha256)
+  @mock.patch.object(beyondcorp.BeyondCorp, '_GetDisk', autospec=True)
+  @mock.patch.object(beyondcorp.hw_info.HWInfo, 'MacAddresses', autospec=True)
+  @mock.patch.object(beyondcorp.requests.Session, 'post', autospec=True)
+  def testWimHashCached(self, req, mac, drive, sha):
+    drive.return_value = 'D'
+    mac.return_value = ['00:00:00:00:00:00']
+    req.return_value = _CreateSignResponse(200, 'Success', DECODED_HASH)
+    beyondcorp.FLAGS.use_signed_url = True
+    beyondcorp.FLAGS.sign_endpoint = 'https://sign-endpoint/sign'
+    beyondcorp.FLAGS.seed_path = r'C:\seed.json'
+
+    beyondcorp.BeyondCorp().GetSignedUrl('unstable/test.yaml')
+    beyondcorp.BeyondCorp().GetSignedUrl('unstable/other.yaml')
+    self.assertEqual(sha.call_count, 1)
+    self.assertEqual(
+        self.beyondcorp._GetHash(_TEST_WIM_PATH), _TEST_WIM_HASH)
+
+  def testGetHash(self):
+    self.assertEqual(self.beyondcorp._GetHash(_TEST_WIM_PATH), _TEST_WIM_HASH)
+
+  def testGetHashMmap(self):
+    wim = self.create_tempfile(content=_TEST_WIM)
+    with mock.patch.object(beyondcorp, 'os', self._os):
+      with mock.patch.object(beyondcorp, 'open', open):
+        self.assertEqual(
+            self.beyondcorp._GetHash(wim.full_path), _TEST_WIM_HASH)
+
+  @mock.patch.object(beyondcorp.mmap, 'mmap', autospec=True)
+  def testGetHashMmapError(self, mm):
+    mm.side_effect = OSError('Not enough memory resources')
+    wim = self.create_tempfile(content=_TEST_WIM)
+    with mock.patch.object(beyondcorp, 'os', self._os):
+      with mock.patch.object(beyondcorp, 'open', open):
+        self.assertEqual(
+            self.beyondcorp._GetHash(wim.full_path), _TEST_WIM_HASH)
+    self.assertTrue(mm.called)
+
+  @flagsaver.flagsaver
   @mock.patch.object(beyondcorp.BeyondCorp, '_GetDisk', autospec=True)
   @mock.patch.object(beyondcorp.hw_info.HWInfo, 'MacAddresses', autospec=True)
-  @mock.patch.object(beyondcorp.requests, 'post', autospec=True)
+  @mock.patch.object(beyondcorp.requests.Session, 'post', autospec=True)
   def testSignedUrlFail(self, req, mac, drive):
     drive.return_value = 'D'
     mac.return_value = ['00:00:00:00:00:00']
@@ -128,9 +252,10 @@ class BeyondcorpTest(absltest.TestCase):
     with self.assertRaises(beyondcorp.BCError):
       self.beyondcorp.GetSignedUrl('unstable/test.yaml')
 
+  @flagsaver.flagsaver
   @mock.patch.object(beyondcorp.BeyondCorp, '_GetDisk', autospec=True)
   @mock.patch.object(beyondcorp.hw_info.HWInfo, 'MacAddresses', autospec=True)
-  @mock.patch.object(beyondcorp.requests, 'post', autospec=True)
+  @mock.patch.object(beyondcorp.requests.Session, 'post', autospec=True)
   def testSignedUrlConnectionError(self, req, mac, drive):
     drive.return_value = 'D'
     mac.return_value = ['00:00:00:00:00:00']
@@ -143,6 +268,11 @@ class BeyondcorpTest(absltest.TestCase):
     with self.assertRaises(beyondcorp.BCError):
       self.beyondcorp.GetSignedUrl('unstable/test.yaml')
 
+    req.side_effect = beyondcorp.requests.exceptions.Timeout
+    with self.assertRaises(beyondcorp.BCError):
+      self.beyondcorp.GetSignedUrl('unstable/test.yaml')
+
+  @flagsaver.flagsaver
   def testReadFile(self):
     beyondcorp.FLAGS.seed_path = r'C:\seed.json'
     seed = self.beyondcorp._ReadFile()
@@ -155,12 +285,75 @@ class BeyondcorpTest(absltest.TestCase):
       beyondcorp.FLAGS.seed_path = r'C:\bad_seed.json'
       self.beyondcorp._ReadFile()
 
+  @mock.patch.object(beyondcorp, 'orjson', None)
+  def testJsonWithoutOrjson(self):
+    self.assertEqual(
+        beyondcorp._JsonDumps({'b': 1, 'a': [2]}), b'{"a":[2],"b":1}')
+    self.assertEqual(beyondcorp._JsonLoads(b'{"a": [2]}'), {'a': [2]})
+    self.assertEqual(
+        beyondcorp._JsonDumps({'Path': _NON_ASCII_PATH}),
+        b'{"Path":"unstable/caf\\u00e9/\\u65e5.yaml"}')
+
+  @unittest.skipIf(beyondcorp.orjson is None, 'orjson is not installed')
+  def testJsonWithOrjson(self):
+    self.assertEqual(
+        beyondcorp._JsonDumps({'b': 1, 'a': [2]}), b'{"a":[2],"b":1}')
+    self.assertEqual(
+        beyondcorp._JsonDumps({'Path': _NON_ASCII_PATH}),
+        b'{"Path":"%s"}' % _NON_ASCII_PATH.encode('utf-8'))
+
+  @flagsaver.flagsaver
+  def testReadFileBom(self):
+    beyondcorp.FLAGS.seed_path = r'C:\bom_seed.json'
+    for backend in (beyondcorp.orjson, None):
+      with mock.patch.object(beyondcorp, 'orjson', backend):
+        with mock.patch.object(beyondcorp, '_seeds', {}):
+          self.assertEqual(self.beyondcorp._ReadFile(), json.loads(_TEST_SEED))
+
+  @mock.patch.object(beyondcorp, 'orjson')
+  def testJsonLoadsBomOrjson(self, oj):
+    beyondcorp._JsonLoads(b'\xef\xbb\xbf{"a": [2]}')
+    oj.loads.assert_called_once_with(b'{"a": [2]}')
+
+  @flagsaver.flagsaver
+  @mock.patch.object(beyondcorp.BeyondCorp, '_GetDisk', autospec=True)
+  @mock.patch.object(beyondcorp.hw_info.HWInfo, 'MacAddresses', autospec=True)
+  @mock.patch.object(beyondcorp.requests.Session, 'post', autospec=True)
+  def testSignedUrlNonAscii(self, req, mac, drive):
+    drive.return_value = 'D'
+    mac.return_value = ['00:00:00:00:00:00']
+    req.return_value = _CreateSignResponse(200, 'Success', DECODED_HASH)
+    beyondcorp.FLAGS.use_signed_url = True
+    beyondcorp.FLAGS.sign_endpoint = 'https://sign-endpoint/sign'
+    beyondcorp.FLAGS.seed_path = r'C:\seed.json'
+    beyondcorp.FLAGS.signed_url_ttl = 0
+
+    for backend in (beyondcorp.orjson, None):
+      with mock.patch.object(beyondcorp, 'orjson', backend):
+        beyondcorp.BeyondCorp().GetSignedUrl(_NON_ASCII_PATH)
+      data = req.call_args[1]['data']
+      self.assertIsInstance(data, bytes)
+      self.assertEqual(json.loads(data.decode('utf-8'))['Path'],
+                       _NON_ASCII_PATH)
+
+  @flagsaver.flagsaver
+  def testReadFileCached(self):
+    beyondcorp.FLAGS.seed_path = r'C:\seed.json'
+    with mock.patch.object(
+        beyondcorp, 'open', wraps=beyondcorp.open) as mock_open:
+      first = self.beyondcorp._ReadFile()
+      second = beyondcorp.BeyondCorp()._ReadFile()
+    self.assertEqual(first, second)
+    mock_open.assert_called_once_with(r'C:\seed.json', 'rb')
+
+  @flagsaver.flagsaver
   @mock.patch.object(registry, 'set_value', autospec=True)
   def testCheckBeyondCorpTrue(self, sv):
     beyondcorp.FLAGS.use_signed_url = True
     sv.assert_called_with = ('beyond_corp', 'True')
     self.assertEqual(self.beyondcorp.CheckBeyondCorp(), True)
 
+  @flagsaver.flagsaver
   @mock.patch.object(registry, 'set_value', autospec=True)
   def testCheckBeyondCorpTrueError(self, sv):
     beyondcorp.FLAGS.use_signed_url = True
@@ -172,35 +365,48 @@ class BeyondcorpTest(absltest.TestCase):
     gv.return_value = 'True'
     self.assertEqual(self.beyondcorp.CheckBeyondCorp(), True)
 
+  @mock.patch.object(registry, 'get_value', autospec=True)
+  def testCheckBeyondCorpCached(self, gv):
+    gv.return_value = 'True'
+    self.assertEqual(self.beyondcorp.CheckBeyondCorp(), True)
+    self.assertEqual(self.beyondcorp.CheckBeyondCorp(), True)
+    gv.assert_called_once_with(
+        'beyond_corp', path=beyondcorp.constants.REG_ROOT)
+
   @mock.patch.object(registry, 'get_value', autospec=True)
   def testCheckBeyondCorpGetError(self, gv):
     gv.side_effect = registry.Error
     self.assertRaises(beyondcorp.BCError, self.beyondcorp.CheckBeyondCorp)
 
+  @flagsaver.flagsaver
   @mock.patch.object(registry, 'set_value', autospec=True)
   def testCheckBeyondCorpFalse(self, sv):
     beyondcorp.FLAGS.use_signed_url = False
     sv.assert_called_with = ('beyond_corp', 'False')
     self.assertEqual(self.beyondcorp.CheckBeyondCorp(), False)
 
+  @flagsaver.flagsaver
   @mock.patch.object(registry, 'set_value', autospec=True)
   def testCheckBeyondCorpFalseError(self, sv):
     beyondcorp.FLAGS.use_signed_url = False
     sv.side_effect = registry.Error
     self.assertRaises(beyondcorp.BCError, self.beyondcorp.CheckBeyondCorp)
 
-  def testGetDisk(self):
-    self.mock_wmi.return_value.Query.return_value = [mock.Mock(Name='D')]
+  @mock.patch.object(beyondcorp.wmi_query, 'WMIQuery', autospec=True)
+  def testGetDisk(self, mock_wmi):
+    mock_wmi.return_value.Query.return_value = [mock.Mock(Name='D')]
     self.assertEqual(
         self.beyondcorp._GetDisk(beyondcorp.constants.USB_VOLUME_LABEL), 'D')
 
-  def testGetDiskNone(self):
-    self.mock_wmi.return_value.Query.return_value = [mock.Mock(Name=None)]
+  @mock.patch.object(beyondcorp.wmi_query, 'WMIQuery', autospec=True)
+  def testGetDiskNone(self, mock_wmi):
+    mock_wmi.return_value.Query.return_value = [mock.Mock(Name=None)]
     with self.assertRaises(beyondcorp.BCError):
       self.beyondcorp._GetDisk(beyondcorp.constants.USB_VOLUME_LABEL)
 
-  def testGetDiskError(self):
-    self.mock_wmi.return_value.Query.side_effect = beyondcorp.wmi_query.WmiError
+  @mock.patch.object(beyondcorp.wmi_query, 'WMIQuery', autospec=True)
+  def testGetDiskError(self, mock_wmi):
+    mock_wmi.return_value.Query.side_effect = beyondcorp.wmi_query.WmiError
     with self.assertRaises(beyondcorp.BCError):
       self.beyondcorp._GetDisk(beyondcorp.constants.USB_VOLUME_LABEL)
 
@@ -21,7 +21,7 @@ import subprocess
 from glazier.lib import constants
 from glazier.lib import powershell
 
-SUPPORTED_MODES = ['ps_tpm', 'bde_tpm']
+SUPPORTED_MODES = frozenset(['ps_tpm', 'bde_tpm'])
 
 
 class BitlockerError(Exception):
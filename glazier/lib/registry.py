@@ -19,11 +19,24 @@ from __future__ import division
 from __future__ import print_function
 
 import logging
-from typing import Optional, Union, List
+from typing import Dict, List, Optional, Union
 
 from glazier.lib import constants
 from gwinpy.registry import registry
 
+try:
+  import winreg  # pylint: disable=g-import-not-at-top
+except ImportError:
+  winreg = None
+
+_ROOT_KEYS = {
+    'HKCR': 'HKEY_CLASSES_ROOT',
+    'HKCU': 'HKEY_CURRENT_USER',
+    'HKLM': 'HKEY_LOCAL_MACHINE',
+    'HKU': 'HKEY_USERS',
+}
+_REG_TYPES = ('REG_DWORD', 'REG_SZ')
+
 
 class Error(Exception):
   pass
@@ -97,6 +110,51 @@ def set_value(name: str, value: Union[str, int],
     raise Error(e)
 
 
+def set_values(values: Dict[str, Union[str, int]],
+               root: Optional[str] = 'HKLM',
+               path: Optional[str] = constants.REG_ROOT,
+               reg_type: Optional[str] = 'REG_SZ',
+               use_64bit: Optional[bool] = constants.USE_REG_64,
+               log: Optional[bool] = True):
+  r"""Set multiple registry values under a single key.
+
+  The key is opened once and every value is written through the same handle.
+  Values are written one at a time; if one fails, earlier values remain set.
+
+  Args:
+    values: Mapping of registry value names to value data.
+    root: Registry root (HKCR\HKCU\HKLM\HKU). Defaults to HKLM.
+    path: Registry key path. Defaults to constants.REG_ROOT.
+    reg_type: Registry value type (REG_DWORD\REG_SZ). Defaults to REG_SZ.
+    use_64bit: True for 64 bit registry. False for 32 bit.
+    Defaults to constants.USE_REG_64.
+    log: Log the registry operation to the standard logger. Defaults to True.
+
+  Raises:
+    Error: The registry is unavailable, the arguments are invalid, or a value
+      could not be written.
+  """
+  if winreg is None:
+    raise Error('The Windows registry is not available on this platform.')
+  if root not in _ROOT_KEYS:
+    raise Error('Unsupported registry root: %s' % root)
+  if reg_type not in _REG_TYPES:
+    raise Error('Unsupported registry value type: %s' % reg_type)
+
+  access = winreg.KEY_WRITE | (
+      winreg.KEY_WOW64_64KEY if use_64bit else winreg.KEY_WOW64_32KEY)
+  try:
+    with winreg.CreateKeyEx(
+        getattr(winreg, _ROOT_KEYS[root]), path, 0, access) as key:
+      for name, value in values.items():
+        winreg.SetValueEx(key, name, 0, getattr(winreg, reg_type), value)
+        if log:
+          logging.debug(r'Set registry value: %s:\%s\%s = %s', root, path,
+                        name, str(value))
+  except OSError as e:
+    raise Error(e)
+
+
 def get_values(path: str,
                root: Optional[str] = 'HKLM',
                use_64bit: Optional[bool] = constants.USE_REG_64,
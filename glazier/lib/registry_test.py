@@ -23,6 +23,12 @@ from glazier.lib import registry
 import mock
 
 
+def _MockWinreg(wr):
+  wr.KEY_WRITE = 0x20006
+  wr.KEY_WOW64_64KEY = 0x0100
+  wr.KEY_WOW64_32KEY = 0x0200
+
+
 class RegistryTest(absltest.TestCase):
 
   def setUp(self):
@@ -97,6 +103,44 @@ class RegistryTest(absltest.TestCase):
     registry.set_value(self.name, self.value, log=False)
     self.assertFalse(d.called)
 
+  @mock.patch.object(registry, 'winreg')
+  def test_set_values(self, wr):
+    _MockWinreg(wr)
+    registry.set_values({self.name: self.value, 'other_key': 'other_value'})
+    wr.CreateKeyEx.assert_called_once_with(
+        wr.HKEY_LOCAL_MACHINE, registry.constants.REG_ROOT, 0, 0x20106)
+    key = wr.CreateKeyEx.return_value.__enter__.return_value
+    wr.SetValueEx.assert_has_calls([
+        mock.call(key, self.name, 0, wr.REG_SZ, self.value),
+        mock.call(key, 'other_key', 0, wr.REG_SZ, 'other_value'),
+    ])
+
+  @mock.patch.object(registry, 'winreg')
+  def test_set_values_32bit(self, wr):
+    _MockWinreg(wr)
+    registry.set_values({self.name: 1}, 'HKCU', r'SOFTWARE\Test', 'REG_DWORD',
+                        use_64bit=False)
+    wr.CreateKeyEx.assert_called_once_with(
+        wr.HKEY_CURRENT_USER, r'SOFTWARE\Test', 0, 0x20206)
+    wr.SetValueEx.assert_called_once_with(
+        wr.CreateKeyEx.return_value.__enter__.return_value, self.name, 0,
+        wr.REG_DWORD, 1)
+
+  @mock.patch.object(registry, 'winreg')
+  def test_set_values_error(self, wr):
+    wr.SetValueEx.side_effect = OSError
+    self.assertRaises(registry.Error, registry.set_values,
+                      {self.name: self.value})
+    self.assertRaises(registry.Error, registry.set_values,
+                      {self.name: self.value}, root='HKXX')
+    self.assertRaises(registry.Error, registry.set_values,
+                      {self.name: self.value}, reg_type='REG_BINARY')
+
+  @mock.patch.object(registry, 'winreg', None)
+  def test_set_values_unavailable(self):
+    self.assertRaises(registry.Error, registry.set_values,
+                      {self.name: self.value})
+
   @mock.patch.object(registry.registry, 'Registry', autospec=True)
   def test_remove_value(self, reg):
     registry.remove_value(self.name)